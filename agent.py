@@ -1,319 +1,982 @@
-import os
-import time
-import json
-import re
-import requests
-import logging
-from typing import Any, Dict, List, Optional
-import yfinance as yf
-import google.generativeai as genai
-
-# Fallback for DuckDuckGo
-try:
-    from duckduckgo_search import DDGS
-except ImportError:
-    DDGS = None
-
-# Configure logger
-logger = logging.getLogger("company_agent")
-logging.basicConfig(level=logging.INFO)
-
-# --- HELPER FUNCTIONS ---
-def safe_generate_text(model_instance, prompt, max_tokens=8192):
-    """
-    Reliably extracts text from Gemini.
-    """
-    try:
-        resp = model_instance.generate_content(
-            prompt, 
-            generation_config={"max_output_tokens": max_tokens, "temperature": 0.3}
-        )
-        if hasattr(resp, "text") and resp.text:
-            return resp.text.strip()
-        if hasattr(resp, "candidates") and resp.candidates:
-            parts = resp.candidates[0].content.parts
-            return "".join([p.text for p in parts]).strip()
-        return ""
-    except Exception as exc:
-        logger.error(f"Gemini API Error: {exc}")
-        return f"Error generating content: {exc}"
-
-def clean_json_string(json_str):
-    """Helper to scrub Markdown formatting from JSON strings."""
-    if "```json" in json_str:
-        json_str = json_str.replace("```json", "").replace("```", "")
-    elif "```" in json_str:
-        json_str = json_str.replace("```", "")
-    return json_str.strip()
-
-class CompanyResearchAgent:
-    def __init__(self, genai_api_key: str, google_api_key: Optional[str] = None, cse_id: Optional[str] = None):
-        # 1. Validate Keys
-        if not genai_api_key:
-            raise ValueError("❌ API Key Error: GOOGLE_GENERATIVEAI_KEY is missing. Please check your .env file.")
-        
-        self.genai_api_key = genai_api_key
-        self.google_api_key = google_api_key
-        self.cse_id = cse_id
-        
-        self.model_name = "gemini-2.5-pro" 
-
-        # Configure Gemini
-        genai.configure(api_key=self.genai_api_key)
-        self.model = genai.GenerativeModel(self.model_name)
-
-        # Initialize State
-        self.company_memory: Dict[str, Dict[str, Any]] = {}
-        self.tool_calls: List[Dict[str, Any]] = []
-        self.chat_history: List[Dict[str, str]] = []
-
-    def _log_tool(self, tool: str, inp: Any, out: Any):
-        """Log for the 'Tools' tab."""
-        self.tool_calls.append({
-            "tool": tool, 
-            "input": str(inp)[:300], 
-            "output": str(out)[:300], 
-            "timestamp": time.time()
-        })
-
-    # --- SEARCH LAYER ---
-    def search_web(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        """Attempts Google Custom Search -> Falls back to DuckDuckGo."""
-        results = []
-        
-        # A. Try Google CSE
-        if self.google_api_key and self.cse_id:
-            try:
-                url = "[https://www.googleapis.com/customsearch/v1](https://www.googleapis.com/customsearch/v1)"
-                params = {"key": self.google_api_key, "cx": self.cse_id, "q": query, "num": top_k}
-                res = requests.get(url, params=params, timeout=5)
-                if res.status_code == 200:
-                    data = res.json()
-                    results = [{"title": i.get("title"), "link": i.get("link"), "snippet": i.get("snippet")} for i in data.get("items", [])]
-                    self._log_tool("Google Search", query, f"Found {len(results)}")
-                    return results
-            except Exception as e:
-                logger.warning(f"Google CSE failed: {e}")
-
-        # B. Fallback to DuckDuckGo
-        if DDGS:
-            try:
-                with DDGS() as ddgs:
-                    raw_res = list(ddgs.text(query, max_results=top_k))
-                    results = [{"title": r['title'], "link": r['href'], "snippet": r['body']} for r in raw_res]
-                    self._log_tool("DuckDuckGo", query, f"Found {len(results)}")
-                    return results
-            except Exception as e:
-                self._log_tool("Search Error", query, str(e))
-        
-        return []
-
-    # --- FINANCIAL LAYER ---
-    def fetch_financials(self, company: str) -> Dict[str, Any]:
-        """Extracts ticker and fetches data via yfinance."""
-        ticker = None
-        
-        match = re.search(r"\b[A-Z]{1,5}\b", company)
-        if match: ticker = match.group(0)
-        
-        if not ticker:
-            hits = self.search_web(f"{company} stock ticker symbol", top_k=1)
-            if hits:
-                m = re.search(r"\b([A-Z]{1,5})\b", hits[0].get("title", "").upper())
-                if m: ticker = m.group(1)
-
-        if not ticker:
-            return {"error": "Could not detect ticker."}
-
-        try:
-            tk = yf.Ticker(ticker)
-            data = {}
-            # Heuristic: Try fast_info first, then info
-            if hasattr(tk, 'fast_info') and tk.fast_info.last_price:
-                data = {
-                    "symbol": ticker,
-                    "market_cap": tk.fast_info.market_cap,
-                    "price": tk.fast_info.last_price,
-                    "currency": tk.fast_info.currency,
-                    "source": "yfinance fast_info"
-                }
-            elif tk.info and 'regularMarketPrice' in tk.info:
-                 data = {
-                    "symbol": ticker,
-                    "market_cap": tk.info.get("marketCap"),
-                    "sector": tk.info.get("sector"),
-                    "summary": tk.info.get("longBusinessSummary", "")[:500]
-                }
-            else:
-                return {"error": "No financial data available"}
-                
-            self._log_tool("YFinance", ticker, "Success")
-            return data
-        except Exception as e:
-            return {"error": str(e)}
-
-    # --- INTENT LAYER ---
-    def classify_intent(self, user_text: str) -> Dict[str, Any]:
-        """Decides what the user wants to do."""
-        prompt = f"""
-        Analyze: "{user_text}"
-        
-        Return valid JSON ONLY:
-        {{
-            "intent": "research" | "follow_up" | "compare" | "off_topic" | "greeting",
-            "companies": ["List", "of", "companies"]
-        }}
-        """
-        try:
-            res = safe_generate_text(self.model, prompt, max_tokens=200)
-            res = clean_json_string(res)
-            if "{" in res:
-                start = res.find("{")
-                end = res.rfind("}") + 1
-                return json.loads(res[start:end])
-            return {"intent": "research", "companies": []}
-        except:
-            return {"intent": "research", "companies": []}
-
-    # --- MAIN LOGIC ---
-    def ask(self, user_text: str, status_callback=None) -> str:
-        self.chat_history.append({"role": "user", "text": user_text})
-        
-        if status_callback: status_callback("🧠 Detecting intent...")
-        intent_data = self.classify_intent(user_text)
-        intent = intent_data.get("intent", "research")
-        companies = intent_data.get("companies", [])
-
-        if intent == "off_topic":
-            return "I specialize in corporate strategy. Please ask me to research a company."
-        
-        if intent == "greeting":
-            return "Hello! I am your Enterprise Research Agent. Ask me to 'Analyze Tesla' or 'Compare Ford and GM'."
-
-        if intent == "compare" and len(companies) >= 2:
-            return self.compare_companies(companies, status_callback)
-
-        company = companies[0] if companies else user_text
-        
-        if intent == "follow_up" and self.company_memory:
-             company = list(self.company_memory.keys())[-1]
-             return self.answer_followup(company, user_text)
-
-        return self.perform_deep_research(company, status_callback)
-
-    def perform_deep_research(self, company_name: str, status_callback) -> str:
-        if status_callback: status_callback(f"🌐 Searching global sources for {company_name}...")
-        search_data = self.search_web(f"{company_name} strategic analysis news")
-        
-        if status_callback: status_callback(f"📈 Analyzing financial markets...")
-        fin_data = self.fetch_financials(company_name)
-
-        if status_callback: status_callback("📝 Writing Comprehensive Report (Step 1/2)...")
-        
-        # --- STEP 1: GENERATE TEXT REPORT ---
-        report_prompt = f"""
-        Role: Senior Strategy Consultant.
-        Task: Create a COMPREHENSIVE Strategic Account Plan for '{company_name}'.
-        
-        Sources:
-        Search: {json.dumps(search_data)[:3000]}
-        Finance: {json.dumps(fin_data)}
-        
-        Instructions:
-        1. Generate a detailed, multi-section report in Markdown.
-        2. **IMPORTANT:** Do NOT include a title page, "Date:", "Prepared by:", or any introductory conversation.
-        3. Start DIRECTLY with the first header (e.g., # Executive Summary).
-        4. Sections required:
-           - **Executive Summary**: High-level strategic overview.
-           - **Product & Services Portfolio**: Detailed breakdown of offerings.
-           - **Market Analysis**: Competitive landscape and position.
-           - **Financial Health**: Analysis of the provided financial metrics.
-           - **SWOT Analysis**: Detailed Strengths, Weaknesses, Opportunities, Threats.
-           - **Strategic Recommendations**: Actionable next steps.
-        """
-        
-        report_text = safe_generate_text(self.model, report_prompt, max_tokens=8000)
-        
-        if status_callback: status_callback("⚙️ Extracting Structured Data (Step 2/2)...")
-
-        # --- STEP 2: EXTRACT JSON ONLY ---
-        json_prompt = f"""
-        You are a Data Extraction Specialist.
-        
-        INPUT TEXT:
-        {report_text[:20000]} (Truncated for safety if extremely long)
-        
-        INSTRUCTIONS:
-        Convert the insights from the text above into a valid JSON object.
-        Do NOT include Markdown formatting (no ```json). Just the raw JSON string.
-        
-        JSON Structure:
-        {{
-            "company_name": "{company_name}",
-            "overview": "Summary of the overview section...",
-            "products_services": ["List of key products..."],
-            "market_position": "Summary of market position...",
-            "swot_analysis": {{ "strengths": [], "weaknesses": [], "opportunities": [], "threats": [] }},
-            "strategic_recommendations": ["List of recommendations..."]
-        }}
-        """
-        
-        json_str = safe_generate_text(self.model, json_prompt, max_tokens=4000)
-        json_str = clean_json_string(json_str)
-        
-        try:
-            json_data = json.loads(json_str)
-        except json.JSONDecodeError:
-            json_data = {"error": "Failed to parse JSON", "raw": json_str}
-        
-        # Store in memory - SAVING 'original_text' SEPARATELY
-        self.company_memory[company_name] = {
-            "text": report_text, 
-            "original_text": report_text, # Keep a copy of the original
-            "json": json_data
-        }
-        return report_text
-
-    def answer_followup(self, company: str, question: str) -> str:
-        mem = self.company_memory.get(company, {})
-        context_text = mem.get('text', '')[:5000] 
-        prompt = f"Context Report: {context_text}. User Question: {question}. Answer professionally."
-        return safe_generate_text(self.model, prompt)
-
-    def compare_companies(self, companies: List[str], status_callback) -> str:
-        if status_callback: status_callback(f"⚖️ Comparing {', '.join(companies)}...")
-        
-        data_points = {}
-        for c in companies:
-            if c not in self.company_memory:
-                self.perform_deep_research(c, None) 
-            data_points[c] = self.company_memory[c].get("json")
-            
-        prompt = f"Compare these companies: {json.dumps(data_points)}. Output a Markdown table and key insights."
-        return safe_generate_text(self.model, prompt)
-
-    # --- EDITOR UTILS ---
-    def list_companies(self): return list(self.company_memory.keys())
-    def get_company_plan(self, c): return self.company_memory.get(c, {})
-    def get_tool_calls(self): return self.tool_calls
-
-    def update_company_section(self, company, section, new_val):
-        mem = self.company_memory.get(company)
-        if not mem: return "Error: Company not found"
-        mem["json"][section] = new_val
-        
-        # Strict formatting, no filler.
-        prompt = f"""
-        The user has manually updated the '{section}' section of the account plan.
-        Updated JSON Data: {json.dumps(mem['json'])}
-        
-        Task: Rewrite the FULL textual report to reflect this change.
-        Constraints:
-        1. STRICTLY maintain the original professional format.
-        2. Do NOT include "Here is the updated report" or any conversational filler.
-        3. Do NOT include dates or prepared by lines.
-        4. Start directly with the Markdown content.
-        """
-        new_text = safe_generate_text(self.model, prompt, max_tokens=8000)
-        mem["text"] = new_text
+import os
+import time
+import re
+import random
+import orjson
+import shelve
+import requests
+import logging
+import datetime
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+import yfinance as yf
+import google.generativeai as genai
+
+from llm_cache import ResponseCache, SemanticCache, cache_path
+
+# Fallback for DuckDuckGo
+try:
+    from duckduckgo_search import DDGS
+except ImportError:
+    DDGS = None
+
+# Transient Gemini errors worth retrying (rate limits, brief outages)
+try:
+    from google.api_core import exceptions as gapi_exceptions
+    RETRYABLE_ERRORS = (
+        gapi_exceptions.ResourceExhausted,
+        gapi_exceptions.ServiceUnavailable,
+        gapi_exceptions.DeadlineExceeded,
+        gapi_exceptions.InternalServerError,
+    )
+except ImportError:
+    RETRYABLE_ERRORS = ()
+
+# Configure logger
+logger = logging.getLogger("company_agent")
+logging.basicConfig(level=logging.INFO)
+
+# Compiled once at import - fetch_financials runs this on every call.
+_TICKER_RE = re.compile(r"\b([A-Z]{1,5})\b")
+
+# Offline map of common company names -> tickers, so recognized companies
+# skip the "<name> stock ticker symbol" web search entirely.
+COMPANY_TICKERS = {
+    "apple": "AAPL",
+    "microsoft": "MSFT",
+    "google": "GOOGL",
+    "alphabet": "GOOGL",
+    "amazon": "AMZN",
+    "meta": "META",
+    "facebook": "META",
+    "tesla": "TSLA",
+    "nvidia": "NVDA",
+    "netflix": "NFLX",
+    "intel": "INTC",
+    "amd": "AMD",
+    "ibm": "IBM",
+    "oracle": "ORCL",
+    "salesforce": "CRM",
+    "adobe": "ADBE",
+    "cisco": "CSCO",
+    "qualcomm": "QCOM",
+    "broadcom": "AVGO",
+    "ford": "F",
+    "general motors": "GM",
+    "gm": "GM",
+    "toyota": "TM",
+    "boeing": "BA",
+    "caterpillar": "CAT",
+    "walmart": "WMT",
+    "costco": "COST",
+    "target": "TGT",
+    "nike": "NKE",
+    "starbucks": "SBUX",
+    "mcdonald's": "MCD",
+    "mcdonalds": "MCD",
+    "coca-cola": "KO",
+    "coca cola": "KO",
+    "pepsico": "PEP",
+    "pepsi": "PEP",
+    "disney": "DIS",
+    "jpmorgan": "JPM",
+    "jp morgan": "JPM",
+    "goldman sachs": "GS",
+    "bank of america": "BAC",
+    "visa": "V",
+    "mastercard": "MA",
+    "paypal": "PYPL",
+    "berkshire hathaway": "BRK-B",
+    "johnson & johnson": "JNJ",
+    "johnson and johnson": "JNJ",
+    "pfizer": "PFE",
+    "moderna": "MRNA",
+    "exxon": "XOM",
+    "exxonmobil": "XOM",
+    "chevron": "CVX",
+    "uber": "UBER",
+    "airbnb": "ABNB",
+    "palantir": "PLTR",
+    "shopify": "SHOP",
+    "spotify": "SPOT",
+    "zoom": "ZM",
+    "snowflake": "SNOW",
+}
+
+# --- HELPER FUNCTIONS ---
+def _call_with_backoff(fn, max_attempts=5):
+    """
+    Runs fn() with jittered exponential backoff (1-30 s) on transient
+    API errors; permanent errors propagate immediately.
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return fn()
+        except RETRYABLE_ERRORS as exc:
+            if attempt == max_attempts:
+                raise
+            delay = min(30.0, 2 ** (attempt - 1) + random.random())
+            logger.warning(f"Transient Gemini error ({exc}); retry {attempt}/{max_attempts - 1} in {delay:.1f}s")
+            time.sleep(delay)
+
+def _raise_if_blocked(resp):
+    feedback = getattr(resp, "prompt_feedback", None)
+    if feedback and getattr(feedback, "block_reason", None):
+        raise RuntimeError(f"Gemini blocked the prompt: {feedback.block_reason}")
+
+# Cache-key prefix for schema-constrained calls: the same prompt returns
+# a different payload (JSON vs prose), so the entries must not collide.
+_STRUCTURED_TAG = "application/json\n"
+
+def safe_generate_text(model_instance, prompt, max_tokens=8192, cache=None, response_schema=None):
+    """
+    Reliably extracts text from Gemini, retrying transient errors with
+    backoff. Permanent errors and blocked prompts raise rather than
+    returning an error string, so broken output never reaches downstream
+    prompts or the caches.
+    Pass a ResponseCache to reuse previous answers for identical prompts.
+    With response_schema set, requests native JSON output (the returned
+    string is then a JSON document matching the schema).
+    """
+    model_name = getattr(model_instance, "model_name", "gemini")
+    cache_prompt = _STRUCTURED_TAG + prompt if response_schema is not None else prompt
+    if cache:
+        cached = cache.get(model_name, cache_prompt)
+        if cached is not None:
+            logger.info("LLM cache hit - skipping Gemini call.")
+            return cached
+    generation_config = {"max_output_tokens": max_tokens, "temperature": 0.3}
+    if response_schema is not None:
+        generation_config["response_mime_type"] = "application/json"
+        generation_config["response_schema"] = response_schema
+    try:
+        resp = _call_with_backoff(lambda: model_instance.generate_content(
+            prompt,
+            generation_config=generation_config
+        ))
+    except Exception as exc:
+        logger.error(f"Gemini API Error: {exc}")
+        raise
+    _raise_if_blocked(resp)
+    text = ""
+    if hasattr(resp, "text") and resp.text:
+        text = resp.text.strip()
+    elif hasattr(resp, "candidates") and resp.candidates:
+        parts = resp.candidates[0].content.parts
+        text = "".join([p.text for p in parts]).strip()
+    if cache and text:
+        cache.set(model_name, cache_prompt, text)
+    return text
+
+def safe_generate_stream(model_instance, prompt, max_tokens=8192, cache=None):
+    """
+    Streaming counterpart of safe_generate_text: yields text chunks as
+    they arrive and caches the assembled response at the end. Like the
+    non-streaming version, transient errors are retried when opening the
+    stream and permanent ones raise.
+    """
+    model_name = getattr(model_instance, "model_name", "gemini")
+    if cache:
+        cached = cache.get(model_name, prompt)
+        if cached is not None:
+            logger.info("LLM cache hit - skipping Gemini call.")
+            yield cached
+            return
+    try:
+        resp = _call_with_backoff(lambda: model_instance.generate_content(
+            prompt, stream=True,
+            generation_config={"max_output_tokens": max_tokens, "temperature": 0.3}
+        ))
+    except Exception as exc:
+        logger.error(f"Gemini API Error: {exc}")
+        raise
+    _raise_if_blocked(resp)
+    chunks = []
+    for chunk in resp:
+        text = getattr(chunk, "text", "")
+        if text:
+            chunks.append(text)
+            yield text
+    if cache and chunks:
+        cache.set(model_name, prompt, "".join(chunks).strip())
+
+# Function declaration for intent classification: the model returns a
+# structured function_call with an enum-typed intent instead of JSON-in-text.
+INTENT_TOOL = genai.protos.Tool(
+    function_declarations=[
+        genai.protos.FunctionDeclaration(
+            name="classify_intent",
+            description="Classify what the user wants the research agent to do.",
+            parameters=genai.protos.Schema(
+                type=genai.protos.Type.OBJECT,
+                properties={
+                    "intent": genai.protos.Schema(
+                        type=genai.protos.Type.STRING,
+                        enum=["research", "follow_up", "compare", "off_topic", "greeting"],
+                    ),
+                    "companies": genai.protos.Schema(
+                        type=genai.protos.Type.ARRAY,
+                        items=genai.protos.Schema(type=genai.protos.Type.STRING),
+                    ),
+                },
+                required=["intent"],
+            ),
+        )
+    ]
+)
+
+# Static instruction blocks. Kept as module constants so they can be
+# server-side cached (Gemini context caching) and only the short variable
+# tail (company name, search/finance JSON) is billed per request.
+REPORT_INSTRUCTIONS = """
+Role: Senior Strategy Consultant.
+Task: Create a COMPREHENSIVE Strategic Account Plan for the company given below.
+
+Instructions:
+1. Put a detailed, multi-section report in Markdown into 'report_markdown'.
+2. **IMPORTANT:** Do NOT include a title page, "Date:", "Prepared by:", or any introductory conversation.
+3. Start DIRECTLY with the first header (e.g., # Executive Summary).
+4. Sections required:
+   - **Executive Summary**: High-level strategic overview.
+   - **Product & Services Portfolio**: Detailed breakdown of offerings.
+   - **Market Analysis**: Competitive landscape and position.
+   - **Financial Health**: Analysis of the provided financial metrics.
+   - **SWOT Analysis**: Detailed Strengths, Weaknesses, Opportunities, Threats.
+   - **Strategic Recommendations**: Actionable next steps.
+5. Fill the remaining fields (overview, products_services, market_position,
+   swot_analysis, strategic_recommendations) with the same insights in
+   structured form.
+"""
+
+# Variant for the two-step fallback: asks for the markdown report only,
+# with no mention of the structured JSON fields.
+REPORT_INSTRUCTIONS_PLAIN = """
+Role: Senior Strategy Consultant.
+Task: Create a COMPREHENSIVE Strategic Account Plan for the company given below.
+
+Instructions:
+1. Generate a detailed, multi-section report in Markdown.
+2. **IMPORTANT:** Do NOT include a title page, "Date:", "Prepared by:", or any introductory conversation.
+3. Start DIRECTLY with the first header (e.g., # Executive Summary).
+4. Sections required:
+   - **Executive Summary**: High-level strategic overview.
+   - **Product & Services Portfolio**: Detailed breakdown of offerings.
+   - **Market Analysis**: Competitive landscape and position.
+   - **Financial Health**: Analysis of the provided financial metrics.
+   - **SWOT Analysis**: Detailed Strengths, Weaknesses, Opportunities, Threats.
+   - **Strategic Recommendations**: Actionable next steps.
+"""
+
+EXTRACTION_INSTRUCTIONS = """
+You are a Data Extraction Specialist.
+
+INSTRUCTIONS:
+Convert the insights from the input text below into a valid JSON object.
+Do NOT include Markdown formatting (no ```json). Just the raw JSON string.
+
+JSON Structure:
+{
+    "company_name": "The company name...",
+    "overview": "Summary of the overview section...",
+    "products_services": ["List of key products..."],
+    "market_position": "Summary of market position...",
+    "swot_analysis": { "strengths": [], "weaknesses": [], "opportunities": [], "threats": [] },
+    "strategic_recommendations": ["List of recommendations..."]
+}
+"""
+
+# Schema for the single-shot research call: the model returns the full
+# markdown report plus the structured fields in one JSON payload.
+_STR = genai.protos.Schema(type=genai.protos.Type.STRING)
+_STR_LIST = genai.protos.Schema(type=genai.protos.Type.ARRAY, items=_STR)
+REPORT_SCHEMA = genai.protos.Schema(
+    type=genai.protos.Type.OBJECT,
+    properties={
+        "report_markdown": _STR,
+        "company_name": _STR,
+        "overview": _STR,
+        "products_services": _STR_LIST,
+        "market_position": _STR,
+        "swot_analysis": genai.protos.Schema(
+            type=genai.protos.Type.OBJECT,
+            properties={
+                "strengths": _STR_LIST,
+                "weaknesses": _STR_LIST,
+                "opportunities": _STR_LIST,
+                "threats": _STR_LIST,
+            },
+        ),
+        "strategic_recommendations": _STR_LIST,
+    },
+    required=["report_markdown", "company_name"],
+)
+
+
+def clean_json_string(json_str):
+    """Helper to scrub Markdown formatting from JSON strings."""
+    if "```json" in json_str:
+        json_str = json_str.replace("```json", "").replace("```", "")
+    elif "```" in json_str:
+        json_str = json_str.replace("```", "")
+    return json_str.strip()
+
+def _condense_search_results(results: List[Dict[str, Any]], max_snippets: int = 8) -> str:
+    """
+    Compacts search results for prompt embedding: drops URLs (long and
+    uninformative, pure token waste), caps each snippet at 240 chars and
+    collapses near-duplicates sharing the same first 64 chars.
+    """
+    seen = set()
+    lines = []
+    for r in results:
+        snippet = (r.get("snippet") or "").strip()
+        if not snippet:
+            continue
+        key = snippet[:64]
+        if key in seen:
+            continue
+        seen.add(key)
+        title = (r.get("title") or "").strip()
+        lines.append(f"- {title}: {snippet[:240]}" if title else f"- {snippet[:240]}")
+        if len(lines) >= max_snippets:
+            break
+    return "\n".join(lines)
+
+def _render_compact(json_data) -> str:
+    """
+    Plain-text digest of a company's structured plan (headings + bulleted
+    SWOT), a few hundred tokens instead of the full JSON dump.
+    """
+    if not isinstance(json_data, dict) or "error" in json_data:
+        return orjson.dumps(json_data).decode()
+    lines = [f"### {json_data.get('company_name', 'Unknown')}"]
+    if json_data.get("overview"):
+        lines.append(f"Overview: {json_data['overview']}")
+    if json_data.get("market_position"):
+        lines.append(f"Market position: {json_data['market_position']}")
+    if json_data.get("products_services"):
+        lines.append("Products/Services: " + "; ".join(map(str, json_data["products_services"])))
+    swot = json_data.get("swot_analysis")
+    if isinstance(swot, dict):
+        for key in ("strengths", "weaknesses", "opportunities", "threats"):
+            if swot.get(key):
+                lines.append(f"{key.capitalize()}:")
+                lines.extend(f"- {v}" for v in swot[key])
+    if json_data.get("strategic_recommendations"):
+        lines.append("Recommendations:")
+        lines.extend(f"- {r}" for r in json_data["strategic_recommendations"])
+    return "\n".join(lines)
+
+# Matches the markdown section headers the report prompt mandates, plus
+# each section body up to the next header.
+_SECTION_RE = re.compile(
+    r"^#+\s*\**(Executive Summary|Product.{0,20}Portfolio|Market Analysis|"
+    r"SWOT Analysis|Strategic Recommendations)\s*\**\s*$"
+    r"(.*?)(?=^#+\s|\Z)",
+    re.M | re.S | re.I,
+)
+
+def _trim_report_for_extraction(report_text: str) -> str:
+    """
+    Keeps only the sections the extraction JSON actually asks about
+    (the Financial Health prose, for one, is never extracted), cutting
+    the prompt size 4-5x. Falls back to a plain truncation when the
+    report does not follow the expected header structure.
+    """
+    sections = _SECTION_RE.findall(report_text)
+    if not sections:
+        return report_text[:20000]
+    return "\n".join(f"## {name.strip()}\n{body.strip()}" for name, body in sections)
+
+def _extract_first_json_obj(s: str) -> Optional[Dict[str, Any]]:
+    """
+    Pulls the first balanced {...} out of LLM output in a single pass,
+    counting brace depth while respecting string literals and escapes
+    (so markdown fences or chatter around the object are ignored).
+    Returns the parsed dict, or None when nothing parseable is found.
+    """
+    depth = 0
+    start = -1
+    in_str = False
+    escaped = False
+    for i, ch in enumerate(s):
+        if in_str:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                try:
+                    return orjson.loads(s[start:i + 1])
+                except orjson.JSONDecodeError:
+                    return None
+    return None
+
+class CompanyMemory:
+    """
+    Bounded LRU mapping of company -> research plan.
+
+    The most recent `maxsize` entries stay in RAM; older ones spill to a
+    shelve file and are transparently promoted back on access, so a
+    long-lived session can research any number of companies without
+    growing memory unboundedly.
+    """
+    def __init__(self, maxsize: int = 64, filename: str = "company_memory"):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._hot: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        try:
+            self._disk = shelve.open(cache_path(filename))
+        except Exception as exc:
+            logger.warning(f"Company memory spillover unavailable: {exc}")
+            self._disk = None
+
+    def _evict_if_needed(self):
+        while len(self._hot) > self.maxsize:
+            company, plan = self._hot.popitem(last=False)
+            if self._disk is not None:
+                try:
+                    self._disk[company] = plan
+                    self._disk.sync()
+                except Exception as exc:
+                    logger.warning(f"Could not spill '{company}' to disk: {exc}")
+
+    def __setitem__(self, company: str, plan: Dict[str, Any]):
+        with self._lock:
+            self._hot[company] = plan
+            self._hot.move_to_end(company)
+            if self._disk is not None and company in self._disk:
+                del self._disk[company]
+            self._evict_if_needed()
+
+    def __getitem__(self, company: str) -> Dict[str, Any]:
+        with self._lock:
+            if company in self._hot:
+                self._hot.move_to_end(company)
+                return self._hot[company]
+            if self._disk is not None and company in self._disk:
+                # Promote from disk so callers get the live dict back
+                plan = self._disk[company]
+                del self._disk[company]
+                self._hot[company] = plan
+                self._evict_if_needed()
+                return plan
+        raise KeyError(company)
+
+    def get(self, company: str, default=None):
+        try:
+            return self[company]
+        except KeyError:
+            return default
+
+    def __contains__(self, company: str) -> bool:
+        if company in self._hot:
+            return True
+        return self._disk is not None and company in self._disk
+
+    def __len__(self) -> int:
+        with self._lock:
+            spilled = len(self._disk) if self._disk is not None else 0
+            return len(self._hot) + spilled
+
+    def keys(self) -> List[str]:
+        """Spilled (older) companies first, then in-RAM ones by recency."""
+        with self._lock:
+            spilled = list(self._disk.keys()) if self._disk is not None else []
+            return spilled + list(self._hot.keys())
+
+
+class CompanyResearchAgent:
+    def __init__(self, genai_api_key: str, google_api_key: Optional[str] = None, cse_id: Optional[str] = None):
+        # 1. Validate Keys
+        if not genai_api_key:
+            raise ValueError("❌ API Key Error: GOOGLE_GENERATIVEAI_KEY is missing. Please check your .env file.")
+        
+        self.genai_api_key = genai_api_key
+        self.google_api_key = google_api_key
+        self.cse_id = cse_id
+        
+        self.model_name = "gemini-2.5-pro" 
+
+        # Configure Gemini
+        genai.configure(api_key=self.genai_api_key)
+        self.model = genai.GenerativeModel(self.model_name)
+
+        # Pooled HTTP session: reuses TCP+TLS connections across searches
+        # (pool sized to match the research thread pool).
+        self.http = requests.Session()
+        self.http.headers.update({"Accept": "application/json"})
+        adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+
+        # Reused DuckDuckGo client - constructing one per search pays a fresh
+        # handshake. Recreated lazily if a call fails (session rotation).
+        self._ddgs = DDGS() if DDGS else None
+        self._ddgs_lock = threading.Lock()
+
+        # Response caching (exact tier always on, semantic tier if deps installed)
+        self.llm_cache = ResponseCache()
+        self.semantic_cache = SemanticCache()
+
+        # Initialize State
+        self.company_memory = CompanyMemory()
+        # Ring buffer: the Tools tab re-renders on every Streamlit rerun,
+        # so the log must stay bounded for long sessions.
+        self.tool_calls: deque = deque(maxlen=200)
+        # Guards company_memory / tool_calls when research runs in worker threads
+        self._state_lock = threading.Lock()
+        # Lazily-created models with server-side cached instruction
+        # prefixes, stored as key -> (model, expiry timestamp) so an
+        # expired CachedContent gets recreated instead of erroring.
+        # Own lock (not _state_lock): creation is a network call and must
+        # not stall tool logging, but concurrent research workers racing
+        # the init would each register a billable CachedContent.
+        self._prefix_models: Dict[str, Any] = {}
+        self._prefix_lock = threading.Lock()
+        # Batch-prefetched financials, consumed by fetch_financials
+        self._fin_prefetch: Dict[str, Dict[str, Any]] = {}
+        # Explicit follow-up target: LRU key order shifts on every read
+        # (the Editor tab promotes whatever it renders), so "last
+        # researched" has to be tracked, not inferred.
+        self._last_company: Optional[str] = None
+
+    # CachedContent lifetime, and how long before expiry we recreate it
+    # (so a call started near the boundary never hits a dead cache).
+    _PREFIX_TTL = datetime.timedelta(hours=1)
+    _PREFIX_REFRESH_MARGIN = 300  # seconds
+
+    def _prefix_model(self, key: str, instructions: str):
+        """
+        Returns (model, inline_prefix) for a prompt with a static
+        instruction block. When Gemini context caching is available the
+        block lives server-side and inline_prefix is empty; otherwise we
+        fall back to the plain model and the caller prepends the block.
+        """
+        with self._prefix_lock:
+            model, expires = self._prefix_models.get(key, (None, 0.0))
+            if key not in self._prefix_models or time.time() > expires - self._PREFIX_REFRESH_MARGIN:
+                try:
+                    cached = genai.caching.CachedContent.create(
+                        model=f"models/{self.model_name}",
+                        contents=[instructions],
+                        ttl=self._PREFIX_TTL,
+                    )
+                    model = genai.GenerativeModel.from_cached_content(cached)
+                    logger.info(f"Context cache created for '{key}' prompts.")
+                except Exception as exc:
+                    logger.warning(f"Context caching unavailable for '{key}' prompts: {exc}")
+                    model = None
+                self._prefix_models[key] = (model, time.time() + self._PREFIX_TTL.total_seconds())
+        if model is None:
+            return self.model, instructions
+        return model, ""
+
+    def _log_tool(self, tool: str, inp: Any, out: Any):
+        """Log for the 'Tools' tab."""
+        with self._state_lock:
+            self.tool_calls.append({
+                "tool": tool,
+                "input": str(inp)[:300],
+                "output": str(out)[:300],
+                "timestamp": time.time()
+            })
+
+    # --- SEARCH LAYER ---
+    def search_web(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        """Attempts Google Custom Search -> Falls back to DuckDuckGo."""
+        results = []
+        
+        # A. Try Google CSE
+        if self.google_api_key and self.cse_id:
+            try:
+                url = "https://www.googleapis.com/customsearch/v1"
+                params = {"key": self.google_api_key, "cx": self.cse_id, "q": query, "num": top_k}
+                res = self.http.get(url, params=params, timeout=5)
+                if res.status_code == 200:
+                    data = res.json()
+                    results = [{"title": i.get("title"), "link": i.get("link"), "snippet": i.get("snippet")} for i in data.get("items", [])]
+                    self._log_tool("Google Search", query, f"Found {len(results)}")
+                    return results
+            except Exception as e:
+                logger.warning(f"Google CSE failed: {e}")
+
+        # B. Fallback to DuckDuckGo
+        if DDGS:
+            try:
+                with self._ddgs_lock:
+                    if self._ddgs is None:
+                        self._ddgs = DDGS()
+                    raw_res = list(self._ddgs.text(query, max_results=top_k))
+                results = [{"title": r['title'], "link": r['href'], "snippet": r['body']} for r in raw_res]
+                self._log_tool("DuckDuckGo", query, f"Found {len(results)}")
+                return results
+            except Exception as e:
+                # Drop the (possibly stale) client; next call rebuilds it.
+                self._ddgs = None
+                self._log_tool("Search Error", query, str(e))
+        
+        return []
+
+    # --- FINANCIAL LAYER ---
+    def _resolve_ticker(self, company: str) -> Optional[str]:
+        """Offline map -> all-caps token in the name -> web search."""
+        ticker = COMPANY_TICKERS.get(company.strip().lower())
+        if ticker:
+            return ticker
+
+        match = _TICKER_RE.search(company)
+        if match:
+            return match.group(1)
+
+        hits = self.search_web(f"{company} stock ticker symbol", top_k=1)
+        if hits:
+            m = _TICKER_RE.search(hits[0].get("title", "").upper())
+            if m: return m.group(1)
+        return None
+
+    @staticmethod
+    def _financial_snapshot(tk, ticker: str) -> Dict[str, Any]:
+        """Builds the metrics dict from a yfinance Ticker object."""
+        # Heuristic: Try fast_info first, then info
+        if hasattr(tk, 'fast_info') and tk.fast_info.last_price:
+            return {
+                "symbol": ticker,
+                "market_cap": tk.fast_info.market_cap,
+                "price": tk.fast_info.last_price,
+                "currency": tk.fast_info.currency,
+                "source": "yfinance fast_info"
+            }
+        if tk.info and 'regularMarketPrice' in tk.info:
+            return {
+                "symbol": ticker,
+                "market_cap": tk.info.get("marketCap"),
+                "sector": tk.info.get("sector"),
+                "summary": tk.info.get("longBusinessSummary", "")[:500]
+            }
+        return {"error": "No financial data available"}
+
+    def fetch_financials(self, company: str) -> Dict[str, Any]:
+        """Extracts ticker and fetches data via yfinance."""
+        # Comparison flows prefetch in batch - use that result if present.
+        prefetched = self._fin_prefetch.pop(company, None)
+        if prefetched is not None:
+            return prefetched
+
+        ticker = self._resolve_ticker(company)
+
+        if not ticker:
+            return {"error": "Could not detect ticker."}
+
+        try:
+            data = self._financial_snapshot(yf.Ticker(ticker), ticker)
+            if "error" not in data:
+                self._log_tool("YFinance", ticker, "Success")
+            return data
+        except Exception as e:
+            return {"error": str(e)}
+
+    def fetch_financials_batch(self, companies: List[str]) -> Dict[str, Dict[str, Any]]:
+        """One yf.Tickers request for all resolvable symbols instead of N."""
+        symbols = {}
+        results: Dict[str, Dict[str, Any]] = {}
+        for c in companies:
+            ticker = self._resolve_ticker(c)
+            if ticker:
+                symbols[c] = ticker
+            else:
+                results[c] = {"error": "Could not detect ticker."}
+
+        if not symbols:
+            return results
+
+        try:
+            batch = yf.Tickers(" ".join(symbols.values()))
+            for company, ticker in symbols.items():
+                try:
+                    results[company] = self._financial_snapshot(batch.tickers[ticker], ticker)
+                except Exception as e:
+                    results[company] = {"error": str(e)}
+            self._log_tool("YFinance Batch", " ".join(symbols.values()), f"Fetched {len(symbols)}")
+        except Exception as e:
+            for company, ticker in symbols.items():
+                results.setdefault(company, {"error": str(e)})
+        return results
+
+    # --- INTENT LAYER ---
+    def classify_intent(self, user_text: str) -> Dict[str, Any]:
+        """Decides what the user wants to do."""
+        # Preferred path: function calling with an enum-typed intent -
+        # no output JSON to scrape and no invalid intent values.
+        try:
+            resp = _call_with_backoff(lambda: self.model.generate_content(
+                f'Classify this user request: "{user_text}"',
+                tools=[INTENT_TOOL],
+                tool_config={"function_calling_config": {"mode": "ANY"}},
+                generation_config={"max_output_tokens": 200, "temperature": 0.3},
+            ))
+            for part in resp.candidates[0].content.parts:
+                fc = getattr(part, "function_call", None)
+                if fc and fc.name == "classify_intent":
+                    args = dict(fc.args)
+                    return {
+                        "intent": args.get("intent", "research"),
+                        "companies": [str(c) for c in args.get("companies", [])],
+                    }
+        except Exception as exc:
+            logger.warning(f"Intent function-calling failed, using JSON prompt: {exc}")
+
+        # Fallback: legacy JSON-in-text prompt + brace scanner.
+        prompt = f"""
+        Analyze: "{user_text}"
+
+        Return valid JSON ONLY:
+        {{
+            "intent": "research" | "follow_up" | "compare" | "off_topic" | "greeting",
+            "companies": ["List", "of", "companies"]
+        }}
+        """
+        res = safe_generate_text(self.model, prompt, max_tokens=200)
+        data = _extract_first_json_obj(res)
+        if isinstance(data, dict) and data.get("intent"):
+            return data
+        return {"intent": "research", "companies": []}
+
+    # --- MAIN LOGIC ---
+    def ask(self, user_text: str, status_callback=None) -> str:
+        if status_callback: status_callback("🧠 Detecting intent...")
+        intent_data = self.classify_intent(user_text)
+        intent = intent_data.get("intent", "research")
+        companies = intent_data.get("companies", [])
+
+        if intent == "off_topic":
+            return "I specialize in corporate strategy. Please ask me to research a company."
+        
+        if intent == "greeting":
+            return "Hello! I am your Enterprise Research Agent. Ask me to 'Analyze Tesla' or 'Compare Ford and GM'."
+
+        if intent == "compare" and len(companies) >= 2:
+            return self.compare_companies(companies, status_callback)
+
+        company = companies[0] if companies else user_text
+        
+        if intent == "follow_up" and self._last_company:
+             company = self._last_company
+             return self.answer_followup(company, user_text)
+
+        return self.perform_deep_research(company, status_callback)
+
+    def ask_stream(self, user_text: str, status_callback=None):
+        """
+        Streaming counterpart of ask(): yields markdown chunks so the UI
+        can render while Gemini is still generating. Research reports are
+        produced by the structured single-shot call, so they arrive as
+        one chunk; follow-ups and comparisons stream token by token.
+        """
+        if status_callback: status_callback("🧠 Detecting intent...")
+        intent_data = self.classify_intent(user_text)
+        intent = intent_data.get("intent", "research")
+        companies = intent_data.get("companies", [])
+
+        if intent == "off_topic":
+            yield "I specialize in corporate strategy. Please ask me to research a company."
+            return
+
+        if intent == "greeting":
+            yield "Hello! I am your Enterprise Research Agent. Ask me to 'Analyze Tesla' or 'Compare Ford and GM'."
+            return
+
+        if intent == "compare" and len(companies) >= 2:
+            if status_callback: status_callback(f"⚖️ Comparing {', '.join(companies)}...")
+            prompt = self._compare_prompt(companies, status_callback)
+            yield from safe_generate_stream(self.model, prompt, cache=self.llm_cache)
+            return
+
+        company = companies[0] if companies else user_text
+
+        if intent == "follow_up" and self._last_company:
+            company = self._last_company
+            cached = self.semantic_cache.get(company, user_text)
+            if cached is not None:
+                logger.info(f"Semantic cache hit for follow-up on {company}.")
+                yield cached
+                return
+            prompt = self._followup_prompt(company, user_text)
+            parts = []
+            for chunk in safe_generate_stream(self.model, prompt, cache=self.llm_cache):
+                parts.append(chunk)
+                yield chunk
+            self.semantic_cache.set(company, user_text, "".join(parts).strip())
+            return
+
+        yield self.perform_deep_research(company, status_callback)
+
+    def perform_deep_research(self, company_name: str, status_callback) -> str:
+        if status_callback: status_callback(f"🌐 Searching global sources & financial markets for {company_name}...")
+
+        # Web search and financials are independent network calls - run both
+        # at once so this stage costs max(search, finance) instead of the sum.
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            f_search = ex.submit(self.search_web, f"{company_name} strategic analysis news")
+            f_fin = ex.submit(self.fetch_financials, company_name)
+            search_data = f_search.result()
+            fin_data = f_fin.result()
+
+        if status_callback: status_callback("📝 Writing Comprehensive Report...")
+
+        # --- SINGLE STRUCTURED CALL: REPORT + JSON TOGETHER ---
+        report_tail = f"""
+        Company: '{company_name}'
+
+        Sources:
+        Search: {_condense_search_results(search_data)}
+        Finance: {orjson.dumps(fin_data).decode()}
+        """
+        model, prefix = self._prefix_model("report", REPORT_INSTRUCTIONS)
+        report_prompt = prefix + report_tail
+
+        raw = safe_generate_text(
+            model, report_prompt, max_tokens=8000,
+            cache=self.llm_cache, response_schema=REPORT_SCHEMA
+        )
+
+        try:
+            json_data = orjson.loads(raw)
+            report_text = json_data.pop("report_markdown")
+        except (orjson.JSONDecodeError, KeyError, TypeError):
+            # Rare: structured output unusable. Fall back to the legacy
+            # two-step pipeline (text report, then extraction call).
+            logger.warning("Structured research output unusable; using two-step fallback.")
+            if status_callback: status_callback("⚙️ Retrying with two-step pipeline...")
+            # Purge the broken payload so the persistent cache doesn't
+            # keep serving it for future research of this company.
+            self.llm_cache.delete(getattr(model, "model_name", "gemini"), _STRUCTURED_TAG + report_prompt)
+            # Plain-report instructions - the structured block would ask
+            # the fallback to populate JSON fields it can't return.
+            plain_model, plain_prefix = self._prefix_model("report_plain", REPORT_INSTRUCTIONS_PLAIN)
+            report_text = safe_generate_text(plain_model, plain_prefix + report_tail, max_tokens=8000, cache=self.llm_cache)
+            json_data = self._extract_report_json(company_name, report_text)
+
+        # Store in memory ('initial_text' is only added once the report
+        # diverges from the original - no duplicate copy up front)
+        with self._state_lock:
+            self.company_memory[company_name] = {
+                "text": report_text,
+                "json": json_data,
+                # Pre-rendered digest so comparisons don't re-dump full JSON
+                "compare_summary": _render_compact(json_data)
+            }
+            self._last_company = company_name
+        return report_text
+
+    def _extract_report_json(self, company_name: str, report_text: str) -> Dict[str, Any]:
+        """Legacy extraction call: re-reads the report and emits JSON."""
+        model, prefix = self._prefix_model("extraction", EXTRACTION_INSTRUCTIONS)
+        json_prompt = f"""{prefix}
+        Company: '{company_name}'
+
+        INPUT TEXT:
+        {_trim_report_for_extraction(report_text)}
+        """
+        json_str = safe_generate_text(model, json_prompt, max_tokens=4000, cache=self.llm_cache)
+        json_str = clean_json_string(json_str)
+        try:
+            return orjson.loads(json_str)
+        except orjson.JSONDecodeError:
+            return {"error": "Failed to parse JSON", "raw": json_str}
+
+    def _followup_prompt(self, company: str, question: str) -> str:
+        mem = self.company_memory.get(company, {})
+        context_text = mem.get('text', '')[:5000]
+        return f"Context Report: {context_text}. User Question: {question}. Answer professionally."
+
+    def answer_followup(self, company: str, question: str) -> str:
+        # Semantic tier: reuse the cached answer for paraphrased questions.
+        cached = self.semantic_cache.get(company, question)
+        if cached is not None:
+            logger.info(f"Semantic cache hit for follow-up on {company}.")
+            return cached
+
+        prompt = self._followup_prompt(company, question)
+        answer = safe_generate_text(self.model, prompt, cache=self.llm_cache)
+        self.semantic_cache.set(company, question, answer)
+        return answer
+
+    def _compare_prompt(self, companies: List[str], status_callback) -> str:
+        # Research uncached companies concurrently - each call is I/O-bound
+        # (web search + yfinance + Gemini), so threads overlap the waits.
+        missing = [c for c in companies if c not in self.company_memory]
+        if missing:
+            # One batched yfinance request up front; the research workers
+            # pick the prefetched data up inside fetch_financials.
+            self._fin_prefetch.update(self.fetch_financials_batch(missing))
+            try:
+                with ThreadPoolExecutor(max_workers=min(8, len(missing))) as ex:
+                    list(ex.map(lambda c: self.perform_deep_research(c, None), missing))
+            finally:
+                # Entries a failed worker never consumed must not leak
+                # into later, unrelated fetch_financials calls.
+                for c in missing:
+                    self._fin_prefetch.pop(c, None)
+
+        summaries = []
+        for c in companies:
+            mem = self.company_memory[c]
+            if "compare_summary" not in mem:
+                # Entries researched before this field existed
+                mem["compare_summary"] = _render_compact(mem.get("json"))
+            summaries.append(mem["compare_summary"])
+
+        return ("Compare these companies:\n\n" + "\n\n".join(summaries) +
+                "\n\nOutput a Markdown table and key insights.")
+
+    def compare_companies(self, companies: List[str], status_callback) -> str:
+        if status_callback: status_callback(f"⚖️ Comparing {', '.join(companies)}...")
+        prompt = self._compare_prompt(companies, status_callback)
+        return safe_generate_text(self.model, prompt, cache=self.llm_cache)
+
+    # --- EDITOR UTILS ---
+    def list_companies(self): return list(self.company_memory.keys())
+    def get_company_plan(self, c): return self.company_memory.get(c, {})
+    def get_tool_calls(self): return list(self.tool_calls)
+
+    def update_company_section(self, company, section, new_val):
+        mem = self.company_memory.get(company)
+        if not mem: return "Error: Company not found"
+        mem["json"][section] = new_val
+        mem["compare_summary"] = _render_compact(mem["json"])
+        # Keep one copy of the pre-edit report for "initial" downloads
+        if "initial_text" not in mem:
+            mem["initial_text"] = mem["text"]
+        
+        # Strict formatting, no filler.
+        prompt = f"""
+        The user has manually updated the '{section}' section of the account plan.
+        Updated JSON Data: {orjson.dumps(mem['json']).decode()}
+        
+        Task: Rewrite the FULL textual report to reflect this change.
+        Constraints:
+        1. STRICTLY maintain the original professional format.
+        2. Do NOT include "Here is the updated report" or any conversational filler.
+        3. Do NOT include dates or prepared by lines.
+        4. Start directly with the Markdown content.
+        """
+        new_text = safe_generate_text(self.model, prompt, max_tokens=8000)
+        mem["text"] = new_text
+        # Write back so the LRU refreshes the entry
+        self.company_memory[company] = mem
+        # Cached follow-up answers describe the pre-edit report
+        self.semantic_cache.invalidate(company)
         return "Report Regenerated Successfully."
\ No newline at end of file
@@ -1,7 +1,8 @@
 import streamlit as st
 import os
-import json
+import orjson
 import time
+from collections import deque
 from dotenv import load_dotenv 
 
 load_dotenv()
@@ -12,10 +13,45 @@ if not api_key:
     st.error("❌ CRITICAL ERROR: GOOGLE_GENERATIVEAI_KEY not found in .env file.")
     st.stop()
 
-# NOW IMPORT AGENT 
+# NOW IMPORT AGENT
 from agent import CompanyResearchAgent
 from fpdf import FPDF
 
+@st.cache_data(show_spinner=False)
+def build_pdf(text: str) -> bytes:
+    """
+    Renders report text to PDF bytes entirely in memory (no temp files).
+    Cached on the text content, so repeat downloads and Streamlit reruns
+    reuse the rendered bytes instead of rebuilding the PDF.
+
+    Lines are pre-wrapped (greedily, by measured string width so they
+    break at the right margin like multi_cell did) and written one cell
+    each, which skips multi_cell's per-character layout over the whole
+    report.
+    """
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+    clean_text = text.encode('latin-1', 'ignore').decode('latin-1')
+    max_w = pdf.w - pdf.l_margin - pdf.r_margin
+    space_w = pdf.get_string_width(" ")
+    for paragraph in clean_text.split("\n"):
+        if not paragraph.strip():
+            pdf.ln(6)
+            continue
+        line_words, line_w = [], 0.0
+        for word in paragraph.split():
+            word_w = pdf.get_string_width(word)
+            if line_words and line_w + space_w + word_w > max_w:
+                pdf.cell(0, 6, " ".join(line_words), new_x="LMARGIN", new_y="NEXT")
+                line_words, line_w = [word], word_w
+            else:
+                line_w += space_w + word_w if line_words else word_w
+                line_words.append(word)
+        if line_words:
+            pdf.cell(0, 6, " ".join(line_words), new_x="LMARGIN", new_y="NEXT")
+    return bytes(pdf.output())
+
 st.set_page_config(page_title="Enterprise Research Agent", page_icon="🧭", layout="wide")
 
 st.markdown("""
@@ -39,7 +75,8 @@ if "agent" not in st.session_state:
         st.stop()
 
 if "chat_history" not in st.session_state:
-    st.session_state.chat_history = []
+    # Bounded: every rerun re-renders the whole history, so cap what we keep
+    st.session_state.chat_history = deque(maxlen=50)
 
 # --- Layout ---
 st.title("🧭 Enterprise Strategy Agent")
@@ -71,9 +108,10 @@ with tabs[0]:
                     time.sleep(0.1) 
                 
                 try:
-                    response = st.session_state.agent.ask(user_input, status_callback=update_ui)
+                    # Stream chunks into the chat as Gemini produces them
+                    stream = st.session_state.agent.ask_stream(user_input, status_callback=update_ui)
+                    response = st.write_stream(stream)
                     status_box.update(label="✅ Task Complete", state="complete", expanded=True)
-                    st.markdown(response)
                     st.session_state.chat_history.append({"role": "assistant", "text": response})
                 except Exception as e:
                     status_box.update(label="❌ Error", state="error", expanded=True)
@@ -106,7 +144,7 @@ with tabs[1]:
                 current_val = json_data[section]
                 
                 if isinstance(current_val, (dict, list)):
-                    txt_val = st.text_area("Edit JSON", json.dumps(current_val, indent=2), height=300)
+                    txt_val = st.text_area("Edit JSON", orjson.dumps(current_val, option=orjson.OPT_INDENT_2).decode(), height=300)
                     is_json = True
                 else:
                     txt_val = st.text_area("Edit Text", str(current_val), height=300)
@@ -119,7 +157,7 @@ with tabs[1]:
                 if st.button("💾 Commit Changes & Update Report"):
                     with st.spinner("Rewriting report..."):
                         try:
-                            val = json.loads(txt_val) if is_json else txt_val
+                            val = orjson.loads(txt_val) if is_json else txt_val
                             msg = st.session_state.agent.update_company_section(selected, section, val)
                             st.success(msg)
                             time.sleep(1) # Give user time to see success message
@@ -136,23 +174,14 @@ with tabs[1]:
                     # Download ORIGINAL (Initial) Report
                     if st.button("📥 Download Initial Report (PDF)"):
                         try:
-                            pdf = FPDF()
-                            pdf.add_page()
-                            pdf.set_font("Arial", size=12)
-                            # Use 'original_text' from memory
-                            original_text = plan.get("original_text", plan.get("text", ""))
-                            clean_text = original_text.encode('latin-1', 'ignore').decode('latin-1')
-                            pdf.multi_cell(0, 10, clean_text)
-                            
-                            # Helper to serve PDF
-                            pdf.output(f"{selected}_Initial.pdf")
-                            with open(f"{selected}_Initial.pdf", "rb") as f:
-                                st.download_button(
-                                    label="Click to Confirm Download (Initial)",
-                                    data=f,
-                                    file_name=f"{selected}_Initial_Report.pdf",
-                                    mime="application/pdf"
-                                )
+                            # Pre-edit report if the plan was updated, else current
+                            original_text = plan.get("initial_text", plan.get("text", ""))
+                            st.download_button(
+                                label="Click to Confirm Download (Initial)",
+                                data=build_pdf(original_text),
+                                file_name=f"{selected}_Initial_Report.pdf",
+                                mime="application/pdf"
+                            )
                         except Exception as e:
                             st.error(f"PDF Error: {e}")
 
@@ -160,22 +189,13 @@ with tabs[1]:
                     # Download UPDATED Report
                     if st.button("📥 Download Updated Report (PDF)"):
                         try:
-                            pdf = FPDF()
-                            pdf.add_page()
-                            pdf.set_font("Arial", size=12)
                             # Use current 'text' from memory
-                            current_text = plan.get("text", "")
-                            clean_text = current_text.encode('latin-1', 'ignore').decode('latin-1')
-                            pdf.multi_cell(0, 10, clean_text)
-                            
-                            pdf.output(f"{selected}_Updated.pdf")
-                            with open(f"{selected}_Updated.pdf", "rb") as f:
-                                st.download_button(
-                                    label="Click to Confirm Download (Updated)",
-                                    data=f,
-                                    file_name=f"{selected}_Updated_Report.pdf",
-                                    mime="application/pdf"
-                                )
+                            st.download_button(
+                                label="Click to Confirm Download (Updated)",
+                                data=build_pdf(plan.get("text", "")),
+                                file_name=f"{selected}_Updated_Report.pdf",
+                                mime="application/pdf"
+                            )
                         except Exception as e:
                             st.error(f"PDF Error: {e}")
 
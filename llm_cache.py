@@ -0,0 +1,136 @@
+import os
+import hashlib
+import shelve
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+# Optional semantic tier (sentence-transformers + numpy). The agent works
+# fine without it; we just skip paraphrase matching.
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    np = None
+    SentenceTransformer = None
+
+logger = logging.getLogger("company_agent")
+
+CACHE_DIR = ".agent_cache"
+
+
+def cache_path(name: str) -> str:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, name)
+
+
+class ResponseCache:
+    """
+    Exact-match cache for Gemini responses.
+
+    Keyed by SHA-256 of (model_name, prompt) and persisted to a local
+    shelve file, so repeat research on the same company skips the API
+    call entirely.
+    """
+    def __init__(self, filename: str = "llm_responses"):
+        self._lock = threading.Lock()
+        try:
+            self._db = shelve.open(cache_path(filename))
+        except Exception as exc:
+            logger.warning(f"Response cache unavailable, running uncached: {exc}")
+            self._db = None
+
+    @staticmethod
+    def make_key(model_name: str, prompt: str) -> str:
+        return hashlib.sha256(f"{model_name}\n{prompt}".encode()).hexdigest()
+
+    def get(self, model_name: str, prompt: str) -> Optional[str]:
+        if self._db is None:
+            return None
+        with self._lock:
+            return self._db.get(self.make_key(model_name, prompt))
+
+    def set(self, model_name: str, prompt: str, response: str):
+        if self._db is None or not response:
+            return
+        with self._lock:
+            try:
+                self._db[self.make_key(model_name, prompt)] = response
+                self._db.sync()
+            except Exception as exc:
+                logger.warning(f"Response cache write failed: {exc}")
+
+    def delete(self, model_name: str, prompt: str):
+        """Drops an entry the caller found to be unusable."""
+        if self._db is None:
+            return
+        with self._lock:
+            try:
+                del self._db[self.make_key(model_name, prompt)]
+                self._db.sync()
+            except KeyError:
+                pass
+            except Exception as exc:
+                logger.warning(f"Response cache delete failed: {exc}")
+
+
+class SemanticCache:
+    """
+    Paraphrase-tolerant cache for follow-up answers.
+
+    Embeds questions with a small sentence-transformers model and keeps
+    one embedding matrix per company; a cosine similarity >= threshold
+    against a stored question returns its cached answer.
+    """
+    def __init__(self, threshold: float = 0.9):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._model = None
+        # company -> {"matrix": np.ndarray (n, dim), "answers": [str, ...]}
+        self._store: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def available(self) -> bool:
+        return SentenceTransformer is not None
+
+    def _embed(self, text: str):
+        if self._model is None:
+            self._model = SentenceTransformer("all-MiniLM-L6-v2")
+        emb = self._model.encode([text], normalize_embeddings=True)
+        return emb[0]
+
+    def get(self, company: str, question: str) -> Optional[str]:
+        if not self.available:
+            return None
+        try:
+            with self._lock:
+                entry = self._store.get(company)
+            if not entry:
+                return None
+            emb = self._embed(question)
+            sims = entry["matrix"] @ emb
+            best = int(np.argmax(sims))
+            if sims[best] >= self.threshold:
+                return entry["answers"][best]
+        except Exception as exc:
+            logger.warning(f"Semantic cache lookup failed: {exc}")
+        return None
+
+    def invalidate(self, company: str):
+        """Drops a company's cached answers, e.g. after its report changed."""
+        with self._lock:
+            self._store.pop(company, None)
+
+    def set(self, company: str, question: str, answer: str):
+        if not self.available or not answer:
+            return
+        try:
+            emb = self._embed(question)
+            with self._lock:
+                entry = self._store.setdefault(
+                    company, {"matrix": np.empty((0, emb.shape[0])), "answers": []}
+                )
+                entry["matrix"] = np.vstack([entry["matrix"], emb])
+                entry["answers"].append(answer)
+        except Exception as exc:
+            logger.warning(f"Semantic cache write failed: {exc}")